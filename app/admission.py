@@ -0,0 +1,235 @@
+import os
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import anyio
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class Ticket:
+    uid: str
+    event: anyio.Event = field(default_factory=anyio.Event)
+    started_at: float | None = None
+    released: bool = False
+    # Solo los trabajos completos alimentan la estimación de Retry-After
+    timed: bool = True
+    # Carril de baja prioridad (batches): usa capacidad global ociosa
+    batch: bool = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.event.is_set()
+
+
+class AdmissionController:
+    """
+    Control de admisión para generaciones: límite de trabajos en curso por usuario
+    y global, con cola de reparto justo (round-robin entre usuarios).
+
+    Las llamadas de batches van por un carril aparte de baja prioridad: no cuentan
+    en la cuota interactiva del usuario, solo arrancan cuando las colas interactivas
+    no pueden usar la plaza libre y nunca ocupan las plazas reservadas a tráfico
+    interactivo (batch_reserved_slots).
+    """
+
+    def __init__(
+        self,
+        max_inflight_per_user: int = 2,
+        max_inflight_global: int = 8,
+        max_queued_per_user: int = 5,
+        max_queued_global: int = 50,
+        default_job_seconds: float = 60.0,
+        batch_reserved_slots: int = 2,
+    ):
+        self.max_inflight_per_user = max(1, max_inflight_per_user)
+        self.max_inflight_global = max(1, max_inflight_global)
+        self.max_queued_per_user = max(0, max_queued_per_user)
+        self.max_queued_global = max(0, max_queued_global)
+        self._inflight: dict[str, int] = {}
+        self._total_inflight = 0
+        # Orden de usuarios en espera: el primero es el siguiente en turno
+        self._waiting: OrderedDict[str, deque[Ticket]] = OrderedDict()
+        self._avg_job_seconds = default_job_seconds
+        # Plazas globales que el carril batch puede ocupar como máximo
+        self.max_batch_inflight = max(1, self.max_inflight_global - max(0, batch_reserved_slots))
+        self._batch_inflight = 0
+        self._batch_waiting: OrderedDict[str, deque[Ticket]] = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_inflight_per_user=int(os.getenv("GENERATION_MAX_INFLIGHT_PER_USER", "2")),
+            max_inflight_global=int(os.getenv("GENERATION_MAX_INFLIGHT_GLOBAL", "8")),
+            max_queued_per_user=int(os.getenv("GENERATION_MAX_QUEUED_PER_USER", "5")),
+            max_queued_global=int(os.getenv("GENERATION_MAX_QUEUED_GLOBAL", "50")),
+            default_job_seconds=float(os.getenv("GENERATION_DEFAULT_JOB_SECONDS", "60")),
+            batch_reserved_slots=int(os.getenv("GENERATION_BATCH_RESERVED_SLOTS", "2")),
+        )
+
+    @property
+    def queued_count(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    def retry_after(self) -> int:
+        # Estimación: tiempo medio de trabajo por "rondas" de cola pendientes
+        rounds = (self.queued_count + 1) / self.max_inflight_global
+        return max(1, math.ceil(self._avg_job_seconds * rounds))
+
+    def enqueue(self, uid: str, bounded: bool = True) -> Ticket:
+        """
+        Registra una petición. Si hay hueco se admite al momento; si no, queda en
+        cola. Lanza AdmissionRejected si la cola (del usuario o global) está llena.
+        Con bounded=False no se aplican los límites de cola (para llamadas internas
+        que ya acotan cuántos tickets tienen pendientes, como los batches).
+        """
+        ticket = Ticket(uid=uid)
+        user_queue = self._waiting.get(uid)
+        if not user_queue and self._can_start(uid):
+            self._start(ticket)
+            return ticket
+        if not bounded:
+            self._waiting.setdefault(uid, deque()).append(ticket)
+            return ticket
+        if user_queue is not None and len(user_queue) >= self.max_queued_per_user:
+            raise AdmissionRejected("Demasiadas generaciones en cola para este usuario", self.retry_after())
+        if self.max_queued_per_user == 0 or self.queued_count >= self.max_queued_global:
+            raise AdmissionRejected("Cola de generación llena", self.retry_after())
+        self._waiting.setdefault(uid, deque()).append(ticket)
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        Posición estimada (1 = el siguiente) según el reparto round-robin.
+        Devuelve 0 si ya está admitido.
+        """
+        if ticket.admitted:
+            return 0
+        own_queue = self._waiting.get(ticket.uid)
+        if not own_queue or ticket not in own_queue:
+            return 0
+        k = own_queue.index(ticket)
+        ahead = k
+        before_own = True
+        for uid, q in self._waiting.items():
+            if uid == ticket.uid:
+                before_own = False
+                continue
+            ahead += min(len(q), k + 1 if before_own else k)
+        return ahead + 1
+
+    async def wait(self, ticket: Ticket, timeout: float | None = None) -> bool:
+        """
+        Espera a que el ticket sea admitido. Devuelve False si vence el timeout.
+        Si la tarea se cancela mientras espera, el ticket sale de la cola.
+        """
+        try:
+            with anyio.move_on_after(timeout):
+                await ticket.event.wait()
+        except BaseException:
+            self.release(ticket)
+            raise
+        return ticket.admitted
+
+    def enqueue_batch(self, uid: str) -> Ticket:
+        """
+        Encola una llamada del carril batch; arranca en cuanto haya capacidad ociosa.
+        """
+        ticket = Ticket(uid=uid, batch=True, timed=False)
+        self._batch_waiting.setdefault(uid, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    @asynccontextmanager
+    async def slot(self, uid: str, batch: bool = False):
+        """
+        Ocupa una plaza durante el bloque, esperando turno si hace falta. Con
+        batch=True usa el carril de baja prioridad en lugar de la cuota del usuario.
+        """
+        if batch:
+            ticket = self.enqueue_batch(uid)
+        else:
+            ticket = self.enqueue(uid, bounded=False)
+            ticket.timed = False
+        try:
+            await self.wait(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+        if not ticket.admitted:
+            waiting = self._batch_waiting if ticket.batch else self._waiting
+            q = waiting.get(ticket.uid)
+            if q and ticket in q:
+                q.remove(ticket)
+                if not q:
+                    del waiting[ticket.uid]
+            return
+        if ticket.batch:
+            self._batch_inflight -= 1
+        else:
+            self._inflight[ticket.uid] -= 1
+            if not self._inflight[ticket.uid]:
+                del self._inflight[ticket.uid]
+        self._total_inflight -= 1
+        if ticket.timed and ticket.started_at is not None:
+            elapsed = time.monotonic() - ticket.started_at
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+        self._dispatch()
+
+    def _can_start(self, uid: str) -> bool:
+        return (
+            self._total_inflight < self.max_inflight_global
+            and self._inflight.get(uid, 0) < self.max_inflight_per_user
+        )
+
+    def _can_start_batch(self) -> bool:
+        return (
+            self._total_inflight < self.max_inflight_global
+            and self._batch_inflight < self.max_batch_inflight
+        )
+
+    def _start(self, ticket: Ticket) -> None:
+        if ticket.batch:
+            self._batch_inflight += 1
+        else:
+            self._inflight[ticket.uid] = self._inflight.get(ticket.uid, 0) + 1
+        self._total_inflight += 1
+        ticket.started_at = time.monotonic()
+        ticket.event.set()
+
+    def _dispatch(self) -> None:
+        # Recorre usuarios en orden round-robin; el usuario servido pasa al final
+        progressed = True
+        while progressed and self._total_inflight < self.max_inflight_global:
+            progressed = False
+            for uid in list(self._waiting.keys()):
+                if not self._can_start(uid):
+                    continue
+                q = self._waiting.pop(uid)
+                self._start(q.popleft())
+                if q:
+                    self._waiting[uid] = q
+                progressed = True
+                break
+        # Carril batch: solo la capacidad que el tráfico interactivo no ha podido usar,
+        # también en round-robin entre usuarios
+        while self._batch_waiting and self._can_start_batch():
+            uid, q = self._batch_waiting.popitem(last=False)
+            self._start(q.popleft())
+            if q:
+                self._batch_waiting[uid] = q
+
+
+generation_admission = AdmissionController.from_env()
@@ -1,16 +1,33 @@
 import os
 import json
 import math
-from dotenv import load_dotenv
+import time
+from typing import TYPE_CHECKING
 import anyio
-from openai import OpenAI
+from .model_router import model_router, models_for_stage
 
-load_dotenv()
+if TYPE_CHECKING:
+    from openai import OpenAI
 
-def get_openrouter_client() -> OpenAI:
-    base_url = "https://openrouter.ai/api/v1"
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    return OpenAI(base_url=base_url, api_key=api_key)
+# Cliente compartido (reutiliza el pool de conexiones); se crea en el primer uso
+_openrouter_client = None
+
+def get_openrouter_client() -> "OpenAI":
+    global _openrouter_client
+    if _openrouter_client is None:
+        from openai import OpenAI
+
+        base_url = "https://openrouter.ai/api/v1"
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        # Sin reintentos del SDK: la cadena de modelos de model_router hace el failover
+        _openrouter_client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+    return _openrouter_client
+
+def close_openrouter_client() -> None:
+    global _openrouter_client
+    if _openrouter_client is not None:
+        _openrouter_client.close()
+        _openrouter_client = None
 
 def clean_code_fences(text: str) -> str:
     return text.replace("```json", "").replace("```", "").strip()
@@ -50,10 +67,16 @@ def try_repair_json(raw: str) -> dict | None:
     except json.JSONDecodeError:
         return None
 
-async def call_model_single(prompt: str, max_tokens: int = 1200) -> str:
+async def call_model_single(prompt: str, max_tokens: int = 1200, stage: str = "lesson") -> str:
+    """
+    Llama al primer modelo sano de la cadena de la fase; si falla o devuelve vacío,
+    pasa al siguiente, con rondas de reintento y backoff exponencial hasta agotar
+    los intentos. Lanza la última excepción si todos fallan.
+    """
     client = get_openrouter_client()
+    timeout = float(os.getenv("OPENROUTER_TIMEOUT_SECONDS", "60"))
 
-    def call():
+    def call(model: str):
         extra_headers = {}
         site_url = os.getenv("OPENROUTER_SITE_URL")
         site_name = os.getenv("OPENROUTER_SITE_NAME")
@@ -63,22 +86,62 @@ async def call_model_single(prompt: str, max_tokens: int = 1200) -> str:
             extra_headers["X-Title"] = site_name
 
         return client.chat.completions.create(
-            model="google/gemini-2.5-flash-lite",
+            model=model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.65,
             max_tokens=max_tokens,
             extra_headers=extra_headers,
+            timeout=timeout,
         )
 
-    completion = await anyio.to_thread.run_sync(call)
-    try:
-        return completion.choices[0].message.content
-    except Exception:
-        return ""
+    chain = models_for_stage(stage)
+    # Al menos min_attempts intentos aunque la cadena tenga un solo modelo: el SDK no
+    # reintenta (max_retries=0), así que los reintentos con backoff se hacen aquí
+    attempts_left = max(model_router.min_attempts, len(chain))
+    last_error: Exception | None = None
+    retry_round = 0
+    while attempts_left > 0:
+        if retry_round:
+            await anyio.sleep(model_router.retry_backoff_seconds * 2 ** (retry_round - 1))
+        retry_round += 1
+        candidates, gated = model_router.candidates(chain)
+        attempted = False
+        for model in candidates:
+            if attempts_left <= 0:
+                break
+            if gated and not model_router.try_acquire(model):
+                continue
+            attempted = True
+            attempts_left -= 1
+            started = time.monotonic()
+            try:
+                completion = await anyio.to_thread.run_sync(call, model)
+                content = completion.choices[0].message.content or ""
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # Cancelación: no cuenta como fallo, pero libera la prueba en curso
+                    model_router.release_trial(model)
+                    raise
+                model_router.record_failure(model, time.monotonic() - started)
+                print(f"[ai_generator] modelo {model} falló ({stage}): {e}")
+                last_error = e
+                continue
+            if not content.strip():
+                model_router.record_failure(model, time.monotonic() - started)
+                print(f"[ai_generator] modelo {model} devolvió respuesta vacía ({stage})")
+                last_error = None
+                continue
+            model_router.record_success(model, time.monotonic() - started)
+            return content
+        if not attempted:
+            attempts_left -= 1
+    if last_error is not None:
+        raise last_error
+    return ""
 
 async def generate_outline_attempt(prompt: str, max_tokens: int = 1200) -> str:
     try:
-        return await call_model_single(prompt, max_tokens=max_tokens)
+        return await call_model_single(prompt, max_tokens=max_tokens, stage="outline")
     except Exception as e:
         print(f"[ai_generator] error en outline attempt: {e}")
         return ""
@@ -112,14 +175,15 @@ def build_fallback_outline(duration_weeks: int) -> dict:
         })
     return {"modules": modules}
 
-async def generate_outline(
+async def try_generate_outline(
     course_title: str,
     level: str,
     duration_weeks: int,
     description: str,
-) -> dict:
+) -> dict | None:
     """
     Fase 1: genera outline adaptado a duration_weeks (un módulo cada ~2 semanas).
+    Devuelve None si ningún intento produjo un outline válido.
     """
     num_modules = max(1, math.ceil(duration_weeks / 2))
     # Calcular rangos de semanas consecutivas
@@ -179,21 +243,23 @@ Devuélveme únicamente un JSON válido similar a este ejemplo (sin texto explic
             break
         await anyio.sleep(0.5 * (attempt + 1))
     if not outline:
-        outline = build_fallback_outline(duration_weeks)
-        print(f"[ai_generator] fallback outline usado, raw último: {raw[:800]}")
+        print(f"[ai_generator] outline inválido tras reintentos, raw último: {raw[:800]}")
     return outline
 
-# Nueva función para generar outline temporal (sin persistir)
-async def generate_outline_temporary(
+async def generate_outline(
     course_title: str,
     level: str,
     duration_weeks: int,
     description: str,
 ) -> dict:
     """
-    Genera outline temporal sin persistir en base de datos
+    Como try_generate_outline, pero usa el outline de relleno si el modelo falla.
     """
-    return await generate_outline(course_title, level, duration_weeks, description)
+    outline = await try_generate_outline(course_title, level, duration_weeks, description)
+    if not outline:
+        outline = build_fallback_outline(duration_weeks)
+        print("[ai_generator] fallback outline usado")
+    return outline
 
 async def expand_lesson(
     course_title: str,
@@ -237,7 +303,7 @@ Respuesta en solo JSON con este formato:
   ]
 }}
 """
-    raw = await call_model_single(prompt, max_tokens=1100)
+    raw = await call_model_single(prompt, max_tokens=1100, stage="lesson")
     parsed = try_repair_json(raw)
     if not parsed:
         raise ValueError(f"Expansion inválida (no JSON) para lección '{lesson_title}': {raw[:400]}")
@@ -246,6 +312,46 @@ Respuesta en solo JSON con este formato:
         raise ValueError(f"Expansion inválida (theory corta) para lección '{lesson_title}': words={len(theory.split())}")
     return parsed
 
+def build_fallback_lesson(lesson_title: str) -> dict:
+    return {
+        "lessonTitle": lesson_title,
+        "theory": "Teoría detallada de al menos 150 palabras debería ir aquí.",
+        "tests": [
+            {
+                "question": "Pregunta de ejemplo?",
+                "options": ["A", "B", "C"],
+                "answer": "A",
+                "solution": "Porque A es correcto.",
+            }
+        ],
+    }
+
+async def expand_lesson_or_fallback(
+    course_title: str,
+    level: str,
+    duration_weeks: int,
+    description: str,
+    module_title: str,
+    topic_title: str,
+    lesson_title: str,
+) -> dict:
+    """
+    Como expand_lesson, pero nunca falla: devuelve una lección de relleno si la expansión no es válida.
+    """
+    try:
+        return await expand_lesson(
+            course_title,
+            level,
+            duration_weeks,
+            description,
+            module_title,
+            topic_title,
+            lesson_title,
+        )
+    except Exception as e:
+        print(f"[ai_generator] fallback lección '{lesson_title}': {e}")
+        return build_fallback_lesson(lesson_title)
+
 async def expand_module(
     course_title: str,
     level: str,
@@ -262,31 +368,16 @@ async def expand_module(
         new_lessons = []
         for lesson in topic.get("lessons", []):
             lt = lesson.get("lessonTitle", "")
-            try:
-                expanded = await expand_lesson(
-                    course_title,
-                    level,
-                    duration_weeks,
-                    description,
-                    mod_title,
-                    top_title,
-                    lt,
-                )
-                new_lessons.append(expanded)
-            except Exception as e:
-                print(f"[ai_generator] fallback lección '{lt}': {e}")
-                new_lessons.append({
-                    "lessonTitle": lt,
-                    "theory": "Teoría detallada de al menos 150 palabras debería ir aquí.",
-                    "tests": [
-                        {
-                            "question": "Pregunta de ejemplo?",
-                            "options": ["A", "B", "C"],
-                            "answer": "A",
-                            "solution": "Porque A es correcto.",
-                        }
-                    ],
-                })
+            expanded = await expand_lesson_or_fallback(
+                course_title,
+                level,
+                duration_weeks,
+                description,
+                mod_title,
+                top_title,
+                lt,
+            )
+            new_lessons.append(expanded)
         topic["lessons"] = new_lessons
     return module
 
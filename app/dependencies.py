@@ -1,6 +1,7 @@
 from fastapi import Header, HTTPException, Depends
 from typing import Optional
 from .firebase_client import verify_firebase_token
+from .admission import generation_admission, AdmissionRejected, Ticket
 
 def get_current_user(authorization: Optional[str] = Header(None)):
     if not authorization:
@@ -13,3 +14,16 @@ def get_current_user(authorization: Optional[str] = Header(None)):
         return decoded  # contiene uid, email, etc.
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))
+
+def admit_generation(uid: str) -> Ticket:
+    # Reserva plaza (o posición en cola) para el uid; 429 inmediato si la cola está llena.
+    # Se llama dentro del endpoint (tras validar el body) y quien la llama debe
+    # liberar el ticket con generation_admission.release(ticket).
+    try:
+        return generation_admission.enqueue(uid)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
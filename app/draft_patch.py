@@ -0,0 +1,118 @@
+import re
+import copy
+from typing import Any
+
+# Campos del draft editables mediante operaciones granulares
+EDITABLE_FIELDS = {"courseTitle", "level", "durationWeeks", "description", "modules"}
+# Índice de array según RFC 6901: solo dígitos ASCII y sin ceros a la izquierda
+ARRAY_INDEX_RE = re.compile(r"^(0|[1-9][0-9]*)$")
+
+def parse_pointer(path: str) -> list[str]:
+    """
+    Convierte un JSON Pointer ("/modules/0/topics/1/lessons/0/theory") en tokens.
+    """
+    if not path.startswith("/"):
+        raise ValueError(f"Ruta inválida '{path}': debe empezar por '/'")
+    tokens = [t.replace("~1", "/").replace("~0", "~") for t in path[1:].split("/")]
+    if not tokens or tokens[0] not in EDITABLE_FIELDS:
+        raise ValueError(f"Ruta inválida '{path}': campo no editable")
+    return tokens
+
+def _list_index(container: list, token: str, path: str, allow_end: bool = False) -> int:
+    if allow_end and token == "-":
+        return len(container)
+    if not ARRAY_INDEX_RE.match(token):
+        raise ValueError(f"Ruta inválida '{path}': índice '{token}' no numérico")
+    idx = int(token)
+    limit = len(container) + 1 if allow_end else len(container)
+    if idx >= limit:
+        raise ValueError(f"Ruta inválida '{path}': índice {idx} fuera de rango")
+    return idx
+
+def _resolve_parent(doc: dict, tokens: list[str], path: str) -> Any:
+    target: Any = doc
+    for token in tokens[:-1]:
+        if isinstance(target, list):
+            target = target[_list_index(target, token, path)]
+        elif isinstance(target, dict):
+            if token not in target:
+                raise ValueError(f"Ruta inválida '{path}': '{token}' no existe")
+            target = target[token]
+        else:
+            raise ValueError(f"Ruta inválida '{path}'")
+    return target
+
+def apply_operation(doc: dict, op: str, path: str, value: Any = None) -> Any:
+    """
+    Aplica una operación estilo JSON Patch (add, replace, remove) sobre doc in situ.
+    Devuelve el valor resultante en la ruta (None si se eliminó).
+    """
+    tokens = parse_pointer(path)
+    parent = _resolve_parent(doc, tokens, path)
+    last = tokens[-1]
+    if op not in ("add", "replace", "remove"):
+        raise ValueError(f"Operación no soportada: '{op}'")
+    if len(tokens) == 1 and op != "replace":
+        raise ValueError(f"Solo se puede usar 'replace' sobre '{last}'")
+    if isinstance(parent, list):
+        if op == "add":
+            parent.insert(_list_index(parent, last, path, allow_end=True), value)
+        elif op == "replace":
+            parent[_list_index(parent, last, path)] = value
+        else:
+            parent.pop(_list_index(parent, last, path))
+            return None
+        return value
+    if not isinstance(parent, dict):
+        raise ValueError(f"Ruta inválida '{path}'")
+    if op == "remove":
+        if last not in parent:
+            raise ValueError(f"Ruta inválida '{path}': '{last}' no existe")
+        del parent[last]
+        return None
+    if op == "replace" and last not in parent:
+        raise ValueError(f"Ruta inválida '{path}': '{last}' no existe")
+    parent[last] = value
+    return value
+
+def apply_operations(doc: dict, operations: list[dict]) -> tuple[dict, list[dict], set[str], list | None]:
+    """
+    Aplica las operaciones sobre una copia de doc (todo o nada).
+    Devuelve (doc_nuevo, cambios, campos_de_primer_nivel_tocados, módulos_afectados).
+    módulos_afectados son los objetos módulo modificados o añadidos, o None si se
+    reemplazó el array "modules" completo (hay que validarlos todos).
+    """
+    updated = copy.deepcopy(doc)
+    changes = []
+    touched = set()
+    affected_modules: list | None = []
+    for operation in operations:
+        path = operation["path"]
+        tokens = parse_pointer(path)
+        result = apply_operation(updated, operation["op"], path, operation.get("value"))
+        touched.add(tokens[0])
+        changes.append({"op": operation["op"], "path": path, "value": copy.deepcopy(result)})
+        if tokens[0] != "modules" or affected_modules is None:
+            continue
+        if len(tokens) == 1:
+            affected_modules = None
+        elif len(tokens) == 2:
+            # add/replace de un módulo entero: el valor insertado ("-" incluido)
+            if operation["op"] != "remove":
+                affected_modules.append(result)
+        else:
+            modules = updated["modules"]
+            affected_modules.append(modules[_list_index(modules, tokens[1], path)])
+    return updated, changes, touched, affected_modules
+
+def modules_to_validate(updated: dict, affected_modules: list | None) -> list:
+    """
+    Módulos que siguen en el draft tras aplicar las operaciones y deben validarse.
+    """
+    modules = updated.get("modules")
+    if not isinstance(modules, list):
+        return []
+    if affected_modules is None:
+        return modules
+    # Por identidad: los índices pueden haberse desplazado con operaciones posteriores
+    return [m for m in modules if any(m is a for a in affected_modules)]
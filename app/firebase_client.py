@@ -1,24 +1,67 @@
-import firebase_admin
-from firebase_admin import credentials, auth as firebase_auth, firestore
 import os
-from dotenv import load_dotenv
+import threading
 
-load_dotenv()
+# firebase_admin y google-cloud-firestore se importan bajo demanda: son lentos de
+# cargar y no deben pagarse al importar la app (arranque en frío serverless).
+_db = None
+_init_lock = threading.Lock()
 
-# Inicializa Firebase Admin una sola vez
-if not firebase_admin._apps:
-    cred_path = os.getenv("FIREBASE_SERVICE_ACCOUNT")
-    if cred_path:
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-    else:
-        firebase_admin.initialize_app()
+ID_TOKEN_CERT_URI = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
 
-db = firestore.client()
+def init_firebase():
+    """
+    Inicializa Firebase Admin una sola vez (de forma perezosa y segura entre hilos).
+    """
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _init_lock:
+        if not firebase_admin._apps:
+            cred_path = os.getenv("FIREBASE_SERVICE_ACCOUNT")
+            if cred_path:
+                cred = credentials.Certificate(cred_path)
+                firebase_admin.initialize_app(cred)
+            else:
+                firebase_admin.initialize_app()
+    return firebase_admin.get_app()
+
+def get_db():
+    global _db
+    if _db is None:
+        init_firebase()
+        from firebase_admin import firestore
+
+        with _init_lock:
+            if _db is None:
+                _db = firestore.client()
+    return _db
 
 def verify_firebase_token(id_token: str) -> dict:
+    init_firebase()
+    from firebase_admin import auth as firebase_auth
+
     try:
         decoded = firebase_auth.verify_id_token(id_token)
         return decoded
     except Exception as e:
         raise ValueError(f"Token inválido: {e}")
+
+def prefetch_auth_certs() -> None:
+    # Descarga los certificados públicos de Firebase Auth con la misma sesión
+    # (con caché HTTP) que usa verify_id_token, para que la primera petición no
+    # pague esa latencia. Usa internals de firebase_admin: es best-effort.
+    from firebase_admin import auth as firebase_auth
+
+    client = firebase_auth._get_client(init_firebase())
+    client._token_verifier.request(ID_TOKEN_CERT_URI)
+
+def warm_up_firebase() -> None:
+    """
+    Inicializa Firebase, abre el canal de Firestore y precarga certificados de Auth.
+    """
+    # Lectura de un documento inexistente: barata, pero establece la conexión gRPC
+    get_db().collection("drafts").document("_warmup").get()
+    try:
+        prefetch_auth_certs()
+    except Exception as e:
+        print(f"[firebase_client] no se pudieron precargar certificados: {e}")
@@ -0,0 +1,66 @@
+import json
+import hashlib
+from .firebase_client import get_db
+
+# Contenido de lecciones direccionado por hash: lecciones idénticas (re-generaciones,
+# forks) se guardan una sola vez y los cursos solo guardan la referencia.
+LESSON_CONTENT_COLLECTION = "lessonContents"
+GET_ALL_CHUNK = 100
+BATCH_MAX_WRITES = 450  # límite de Firestore: 500 operaciones por WriteBatch
+
+def lesson_content(lesson: dict) -> dict:
+    return {
+        "theory": lesson.get("theory"),
+        "tests": lesson.get("tests", []),
+    }
+
+def content_hash(content: dict) -> str:
+    canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+def write_in_batches(writes: list[tuple]) -> None:
+    """
+    Escribe pares (ref, data) agrupados en WriteBatch en lugar de un set() por documento.
+    """
+    db = get_db()
+    for chunk in _chunks(writes, BATCH_MAX_WRITES):
+        batch = db.batch()
+        for ref, data in chunk:
+            batch.set(ref, data)
+        batch.commit()
+
+def missing_lesson_contents(contents: dict[str, dict]) -> list[tuple]:
+    """
+    Devuelve las escrituras (ref, data) necesarias para los contenidos que aún no existen.
+    """
+    db = get_db()
+    collection = db.collection(LESSON_CONTENT_COLLECTION)
+    refs = [collection.document(h) for h in contents]
+    existing = set()
+    for chunk in _chunks(refs, GET_ALL_CHUNK):
+        for snap in db.get_all(chunk, field_paths=[]):
+            if snap.exists:
+                existing.add(snap.id)
+    return [
+        (collection.document(h), content)
+        for h, content in contents.items()
+        if h not in existing
+    ]
+
+def fetch_lesson_contents(hashes: list[str]) -> dict[str, dict]:
+    """
+    Lee los contenidos referenciados con get_all en bloques de GET_ALL_CHUNK.
+    """
+    db = get_db()
+    collection = db.collection(LESSON_CONTENT_COLLECTION)
+    unique = list(dict.fromkeys(hashes))
+    found = {}
+    for chunk in _chunks(unique, GET_ALL_CHUNK):
+        for snap in db.get_all([collection.document(h) for h in chunk]):
+            if snap.exists:
+                found[snap.id] = snap.to_dict()
+    return found
@@ -1,12 +1,36 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from .routers import drafts, courses
 import os
 from dotenv import load_dotenv
 
+# Único punto de carga del .env: debe ir antes de importar módulos que leen la configuración
 load_dotenv()
 
-app = FastAPI(title="Course AI Backend")
+from contextlib import asynccontextmanager
+import anyio
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from .routers import drafts, courses, batches
+from .firebase_client import warm_up_firebase
+from .ai_generator import get_openrouter_client, close_openrouter_client
+
+async def warm_up():
+    # Firebase/Firestore y el cliente LLM se inicializan en paralelo en hilos
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(anyio.to_thread.run_sync, warm_up_firebase)
+        tg.start_soon(anyio.to_thread.run_sync, get_openrouter_client)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Por defecto todo se inicializa en la primera petición que lo necesita;
+    # con WARMUP_ON_STARTUP=1 se hace antes de aceptar tráfico.
+    if os.getenv("WARMUP_ON_STARTUP", "").lower() in ("1", "true", "yes"):
+        try:
+            await warm_up()
+        except Exception as e:
+            print(f"[main] warm-up fallido, se inicializará bajo demanda: {e}")
+    yield
+    close_openrouter_client()
+
+app = FastAPI(title="Course AI Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,3 +42,4 @@ app.add_middleware(
 
 app.include_router(drafts.router)
 app.include_router(courses.router)
+app.include_router(batches.router)
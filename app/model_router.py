@@ -0,0 +1,160 @@
+import os
+import time
+import random
+from dataclasses import dataclass
+
+DEFAULT_MODEL = "google/gemini-2.5-flash-lite"
+
+def models_for_stage(stage: str) -> list[str]:
+    """
+    Cadena de modelos (en orden de preferencia) para una fase: "outline" o "lesson".
+    Se configura con OPENROUTER_OUTLINE_MODELS / OPENROUTER_LESSON_MODELS separados por comas.
+    """
+    raw = os.getenv(f"OPENROUTER_{stage.upper()}_MODELS") or os.getenv("OPENROUTER_MODELS") or DEFAULT_MODEL
+    models = [m.strip() for m in raw.split(",") if m.strip()]
+    return models or [DEFAULT_MODEL]
+
+@dataclass
+class ModelStats:
+    samples: int = 0
+    ewma_latency: float = 0.0
+    ewma_error_rate: float = 0.0
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+    half_open: bool = False
+    trial_in_flight: bool = False
+
+class ModelRouter:
+    """
+    Ordena los modelos de una cadena según latencia y tasa de error recientes,
+    con circuit breaker por modelo tras fallos consecutivos. Los modelos aún sin
+    datos se prueban primero (una llamada de sondeo cada vez) y, con probabilidad
+    explore_rate, se adelanta otro modelo para refrescar sus estadísticas.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30.0,
+        failure_penalty_seconds: float = 60.0,
+        explore_rate: float = 0.05,
+        min_attempts: int = 3,
+        retry_backoff_seconds: float = 1.0,
+        alpha: float = 0.2,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_seconds = cooldown_seconds
+        self.failure_penalty_seconds = failure_penalty_seconds
+        self.explore_rate = explore_rate
+        # Intentos mínimos por llamada (recorriendo la cadena con backoff entre rondas)
+        self.min_attempts = max(1, min_attempts)
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.alpha = alpha
+        self._stats: dict[str, ModelStats] = {}
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        return cls(
+            failure_threshold=int(os.getenv("MODEL_CIRCUIT_FAILURES", "3")),
+            cooldown_seconds=float(os.getenv("MODEL_CIRCUIT_COOLDOWN_SECONDS", "30")),
+            # Un fallo cuesta como un timeout: un modelo que falla rápido no es "rápido"
+            failure_penalty_seconds=float(os.getenv("OPENROUTER_TIMEOUT_SECONDS", "60")),
+            explore_rate=float(os.getenv("MODEL_EXPLORE_RATE", "0.05")),
+            min_attempts=int(os.getenv("MODEL_MIN_ATTEMPTS", "3")),
+            retry_backoff_seconds=float(os.getenv("MODEL_RETRY_BACKOFF_SECONDS", "1")),
+        )
+
+    def stats(self, model: str) -> ModelStats:
+        return self._stats.setdefault(model, ModelStats())
+
+    def is_available(self, model: str) -> bool:
+        s = self.stats(model)
+        if s.open_until > time.monotonic():
+            return False
+        # Tras el enfriamiento solo se deja pasar una petición de prueba (half-open)
+        return not (s.half_open and s.trial_in_flight)
+
+    def try_acquire(self, model: str) -> bool:
+        """
+        Reserva el uso del modelo justo antes de llamarlo. En half-open solo el
+        primer llamante obtiene la prueba; el resto debe pasar al siguiente modelo.
+        Para un modelo sin datos, marca el sondeo en curso.
+        """
+        if not self.is_available(model):
+            return False
+        s = self.stats(model)
+        if s.half_open or not s.samples:
+            s.trial_in_flight = True
+        return True
+
+    def release_trial(self, model: str) -> None:
+        # La prueba half-open o el sondeo terminó sin resultado (p. ej. tarea cancelada)
+        self.stats(model).trial_in_flight = False
+
+    def score(self, model: str) -> float:
+        # Latencia esperada penalizada por la probabilidad de tener que reintentar
+        s = self.stats(model)
+        return s.ewma_latency / max(0.05, 1.0 - s.ewma_error_rate)
+
+    def order(self, models: list[str]) -> list[str]:
+        """
+        Modelos disponibles en orden de preferencia: primero los aún sin datos
+        (optimista: se sondean para poder compararlos), luego los conocidos del más
+        rápido al más lento y al final los sin datos con un sondeo ya en curso.
+        Los que tienen el circuito abierto no se incluyen.
+        """
+        available = [m for m in models if self.is_available(m)]
+        unknown = [m for m in available if not self.stats(m).samples]
+        probes = [m for m in unknown if not self.stats(m).trial_in_flight]
+        probing = [m for m in unknown if self.stats(m).trial_in_flight]
+        known = sorted((m for m in available if self.stats(m).samples), key=self.score)
+        ordered = probes + known + probing
+        # Exploración: de vez en cuando se adelanta otro modelo para que un primario
+        # que se recupera (o un fallback que mejora) vuelva a tener datos recientes
+        if len(ordered) > 1 and random.random() < self.explore_rate:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+        return ordered
+
+    def candidates(self, models: list[str]) -> tuple[list[str], bool]:
+        """
+        Devuelve (modelos a intentar, si hay que pasar por try_acquire). Si toda la
+        cadena tiene el circuito abierto no hay alternativa sana: se intenta igualmente
+        (el que antes cierra su enfriamiento primero) en lugar de fallar en bloque.
+        """
+        ordered = self.order(models)
+        if ordered:
+            return ordered, True
+        return sorted(models, key=lambda m: self.stats(m).open_until), False
+
+    def record_success(self, model: str, latency: float) -> None:
+        s = self.stats(model)
+        if s.samples:
+            s.ewma_latency = (1 - self.alpha) * s.ewma_latency + self.alpha * latency
+        else:
+            s.ewma_latency = latency
+        s.ewma_error_rate = (1 - self.alpha) * s.ewma_error_rate
+        s.samples += 1
+        s.consecutive_failures = 0
+        s.open_until = 0.0
+        s.half_open = False
+        s.trial_in_flight = False
+
+    def record_failure(self, model: str, latency: float) -> None:
+        s = self.stats(model)
+        # Se penaliza como un timeout aunque haya fallado rápido (429, 400...)
+        penalty = max(latency, self.failure_penalty_seconds)
+        if s.samples:
+            s.ewma_latency = (1 - self.alpha) * s.ewma_latency + self.alpha * penalty
+        else:
+            s.ewma_latency = penalty
+        s.ewma_error_rate = (1 - self.alpha) * s.ewma_error_rate + self.alpha
+        s.samples += 1
+        s.consecutive_failures += 1
+        s.trial_in_flight = False
+        # En half-open basta un fallo para volver a abrir el circuito
+        if s.half_open or s.consecutive_failures >= self.failure_threshold:
+            s.open_until = time.monotonic() + self.cooldown_seconds
+            s.half_open = True
+            print(f"[model_router] circuito abierto para {model} ({s.consecutive_failures} fallos seguidos)")
+
+model_router = ModelRouter.from_env()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, List, Literal, Optional
 
 class TestItem(BaseModel):
     question: str
@@ -27,6 +27,7 @@ class CourseDraftRequest(BaseModel):
     level: str
     durationWeeks: int
     description: str
+    forceFresh: bool = False  # ignora el índice de outlines y genera uno nuevo
 
 class CourseDraftUpdateRequest(BaseModel):
     courseTitle: Optional[str] = None
@@ -34,6 +35,19 @@ class CourseDraftUpdateRequest(BaseModel):
     durationWeeks: Optional[int] = None
     description: Optional[str] = None
     modules: Optional[List[Module]] = None
+    ifUpdateTime: Optional[str] = None  # updateTime (RFC 3339) de la última lectura
+
+class DraftOperation(BaseModel):
+    op: Literal["add", "replace", "remove"]
+    path: str  # JSON Pointer, p. ej. "/modules/0/topics/0/lessons/0/tests/0/question"
+    value: Optional[Any] = None
+
+class DraftPatchRequest(BaseModel):
+    operations: List[DraftOperation]
+    ifUpdateTime: Optional[str] = None  # updateTime (RFC 3339) de la última lectura
 
 class PublishDraftRequest(BaseModel):
     thumbnail: Optional[str] = None
+
+class CourseDraftBatchRequest(BaseModel):
+    courses: List[CourseDraftRequest]
@@ -0,0 +1,147 @@
+import os
+import copy
+import time
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from .firebase_client import get_db
+from .ai_generator import try_generate_outline, build_fallback_outline
+from .utils import slugify
+
+OUTLINE_REUSE_THRESHOLD = float(os.getenv("OUTLINE_REUSE_THRESHOLD", "0.6"))
+OUTLINE_INDEX_MAX_ENTRIES = int(os.getenv("OUTLINE_INDEX_MAX_ENTRIES", "5"))
+OUTLINE_INDEX_CACHE_SIZE = int(os.getenv("OUTLINE_INDEX_CACHE_SIZE", "512"))
+# Caducidad de la caché local: otras instancias pueden indexar outlines nuevos
+OUTLINE_INDEX_CACHE_TTL_SECONDS = float(os.getenv("OUTLINE_INDEX_CACHE_TTL_SECONDS", "60"))
+
+# Caché en memoria de las entradas del índice (clave -> (caduca_en, entradas))
+_cache: OrderedDict[str, tuple[float, list]] = OrderedDict()
+
+def outline_key(course_title: str, level: str, duration_weeks: int) -> str:
+    # Ignora mayúsculas, acentos, puntuación y espacios: "Python para principiantes" == "python  para Principiantes"
+    raw = f"{slugify(course_title)}|{slugify(level)}|{duration_weeks}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def description_tokens(description: str) -> list[str]:
+    return sorted({t for t in slugify(description).split("-") if len(t) > 2})
+
+def token_set_similarity(a: list[str], b: list[str]) -> float:
+    set_a, set_b = set(a), set(b)
+    if not set_a and not set_b:
+        return 1.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+def _cache_put(key: str, entries: list) -> None:
+    _cache[key] = (time.monotonic() + OUTLINE_INDEX_CACHE_TTL_SECONDS, entries)
+    _cache.move_to_end(key)
+    while len(_cache) > OUTLINE_INDEX_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+def _load_entries(key: str) -> list:
+    cached = _cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        _cache.move_to_end(key)
+        return cached[1]
+    doc = get_db().collection("outlineIndex").document(key).get()
+    entries = doc.to_dict().get("entries", []) if doc.exists else []
+    _cache_put(key, entries)
+    return entries
+
+def find_similar_outline(
+    course_title: str,
+    level: str,
+    duration_weeks: int,
+    description: str,
+    threshold: float = OUTLINE_REUSE_THRESHOLD,
+) -> dict | None:
+    """
+    Busca un outline ya generado con mismo título/nivel/duración normalizados
+    y descripción suficientemente parecida. Devuelve una copia o None.
+    """
+    try:
+        entries = _load_entries(outline_key(course_title, level, duration_weeks))
+    except Exception as e:
+        print(f"[outline_index] error leyendo índice: {e}")
+        return None
+    tokens = description_tokens(description)
+    best, best_score = None, threshold
+    for entry in entries:
+        score = token_set_similarity(tokens, entry.get("descriptionTokens", []))
+        if score >= best_score:
+            best, best_score = entry, score
+    if best is None:
+        return None
+    return copy.deepcopy(best["outline"])
+
+def store_outline(
+    course_title: str,
+    level: str,
+    duration_weeks: int,
+    description: str,
+    outline: dict,
+) -> None:
+    """
+    Añade el outline al índice dentro de una transacción, fusionando con las
+    entradas que otras instancias hayan escrito mientras tanto.
+    """
+    from google.cloud import firestore
+
+    key = outline_key(course_title, level, duration_weeks)
+    tokens = description_tokens(description)
+    new_entry = {
+        "descriptionTokens": tokens,
+        "outline": copy.deepcopy(outline),
+        "createdAt": datetime.utcnow(),
+    }
+    db = get_db()
+    ref = db.collection("outlineIndex").document(key)
+
+    @firestore.transactional
+    def merge_entries(transaction) -> list:
+        snap = ref.get(transaction=transaction)
+        current = snap.to_dict().get("entries", []) if snap.exists else []
+        # Una descripción equivalente sustituye a la entrada anterior
+        entries = [
+            e for e in current
+            if token_set_similarity(e.get("descriptionTokens", []), tokens) < 1.0
+        ]
+        entries.append(new_entry)
+        entries = entries[-OUTLINE_INDEX_MAX_ENTRIES:]
+        transaction.set(ref, {
+            "courseTitle": course_title,
+            "level": level,
+            "durationWeeks": duration_weeks,
+            "entries": entries,
+            "updatedAt": datetime.utcnow(),
+        })
+        return entries
+
+    try:
+        _cache_put(key, merge_entries(db.transaction()))
+    except Exception as e:
+        print(f"[outline_index] error guardando índice: {e}")
+
+async def get_or_generate_outline(
+    course_title: str,
+    level: str,
+    duration_weeks: int,
+    description: str,
+    force_fresh: bool = False,
+    persist: bool = True,
+) -> tuple[dict, bool]:
+    """
+    Reutiliza un outline casi idéntico del índice o genera uno nuevo (y lo indexa).
+    Devuelve (outline, reutilizado). Los outlines de relleno nunca se indexan.
+    Con persist=False solo se lee el índice: el outline nuevo no se guarda.
+    """
+    if not force_fresh:
+        reused = find_similar_outline(course_title, level, duration_weeks, description)
+        if reused:
+            return reused, True
+    outline = await try_generate_outline(course_title, level, duration_weeks, description)
+    if not outline:
+        print("[outline_index] fallback outline usado")
+        return build_fallback_outline(duration_weeks), False
+    if persist:
+        store_outline(course_title, level, duration_weeks, description, outline)
+    return outline, False
@@ -0,0 +1,290 @@
+# app/routers/batches.py
+from fastapi import APIRouter, Depends, HTTPException, Path, BackgroundTasks
+from typing import List
+from ..models import CourseDraftRequest, CourseDraftBatchRequest
+from ..dependencies import get_current_user, admit_generation
+from ..admission import generation_admission, Ticket
+from ..firebase_client import get_db
+from ..ai_generator import expand_lesson_or_fallback
+from ..outline_index import get_or_generate_outline
+from datetime import datetime
+import anyio
+import uuid
+import os
+
+router = APIRouter(tags=["batches"])
+
+BATCH_MAX_COURSES = int(os.getenv("GENERATION_BATCH_MAX_COURSES", "50"))
+# Llamadas simultáneas por batch. Además, todos los batches comparten el carril de baja
+# prioridad de generation_admission: como mucho GENERATION_MAX_INFLIGHT_GLOBAL menos
+# GENERATION_BATCH_RESERVED_SLOTS llamadas, y solo con capacidad ociosa.
+BATCH_CONCURRENCY = int(os.getenv("GENERATION_BATCH_CONCURRENCY", "8"))
+
+def interleave_lesson_jobs(outlines: List[dict | None]) -> List[tuple[int, int, int, int]]:
+    """
+    Devuelve (curso, módulo, tópico, lección) intercalando cursos en round-robin,
+    para que todos avancen a la vez en lugar de uno tras otro.
+    """
+    per_course = []
+    for course_idx, outline in enumerate(outlines):
+        jobs = []
+        for m_idx, module in enumerate((outline or {}).get("modules", [])):
+            for t_idx, topic in enumerate(module.get("topics", [])):
+                for l_idx, _ in enumerate(topic.get("lessons", [])):
+                    jobs.append((course_idx, m_idx, t_idx, l_idx))
+        per_course.append(jobs)
+    interleaved = []
+    for i in range(max((len(j) for j in per_course), default=0)):
+        for jobs in per_course:
+            if i < len(jobs):
+                interleaved.append(jobs[i])
+    return interleaved
+
+async def run_batch(
+    batch_id: str,
+    requests: List[CourseDraftRequest],
+    draft_ids: List[str],
+    uid: str,
+    ticket: Ticket,
+):
+    batch_ref = get_db().collection("draftBatches").document(batch_id)
+    draft_refs = [get_db().collection("drafts").document(d) for d in draft_ids]
+    # Cada llamada al modelo ocupa una plaza del carril batch de generation_admission:
+    # cuenta en el presupuesto global pero cede el paso al tráfico interactivo.
+    # El limitador local acota la concurrencia de este batch.
+    limiter = anyio.CapacityLimiter(max(1, BATCH_CONCURRENCY))
+    outlines: List[dict | None] = [None] * len(requests)
+    progress = {"coursesDone": 0, "coursesFailed": 0, "lessonsDone": 0}
+    # Cursos ya cerrados (draft o error); el resto se marca como error si el batch falla
+    finished: set[int] = set()
+    try:
+        # El ticket del endpoint solo da turno de arranque; después se libera para
+        # no ocupar una plaza que necesitan las propias llamadas del batch
+        await generation_admission.wait(ticket)
+        generation_admission.release(ticket)
+        batch_ref.update({"status": "generating", "updatedAt": datetime.utcnow()})
+
+        # 1. Outlines de todos los cursos en paralelo
+        async def build_outline(idx: int):
+            request = requests[idx]
+            try:
+                async with limiter, generation_admission.slot(uid, batch=True):
+                    outline, _ = await get_or_generate_outline(
+                        course_title=request.courseTitle,
+                        level=request.level,
+                        duration_weeks=request.durationWeeks,
+                        description=request.description,
+                        force_fresh=request.forceFresh,
+                    )
+                outlines[idx] = outline
+                draft_refs[idx].update({
+                    "modules": outline.get("modules", []),
+                    "status": "generating",
+                    "updatedAt": datetime.utcnow(),
+                })
+            except Exception as e:
+                progress["coursesFailed"] += 1
+                finished.add(idx)
+                draft_refs[idx].update({
+                    "status": "error",
+                    "errorMessage": str(e),
+                    "updatedAt": datetime.utcnow(),
+                })
+                print(f"[run_batch] error outline curso {idx}:", e)
+
+        async with anyio.create_task_group() as tg:
+            for idx in range(len(requests)):
+                tg.start_soon(build_outline, idx)
+
+        jobs = interleave_lesson_jobs(outlines)
+        pending_modules: dict[tuple[int, int], int] = {}
+        pending_courses: dict[int, int] = {}
+        for course_idx, m_idx, _, _ in jobs:
+            pending_modules[(course_idx, m_idx)] = pending_modules.get((course_idx, m_idx), 0) + 1
+            pending_courses[course_idx] = pending_courses.get(course_idx, 0) + 1
+        batch_ref.update({
+            "lessonsTotal": len(jobs),
+            "coursesFailed": progress["coursesFailed"],
+            "updatedAt": datetime.utcnow(),
+        })
+
+        def finish_course(course_idx: int):
+            draft_refs[course_idx].update({
+                "modules": outlines[course_idx].get("modules", []),
+                "status": "draft",
+                "updatedAt": datetime.utcnow(),
+            })
+            finished.add(course_idx)
+            progress["coursesDone"] += 1
+
+        # Cursos con outline pero sin lecciones: ya están completos
+        for course_idx, outline in enumerate(outlines):
+            if outline is not None and course_idx not in pending_courses:
+                finish_course(course_idx)
+
+        # 2. Expansión de lecciones intercalada entre cursos
+        async def expand_job(job: tuple[int, int, int, int]):
+            course_idx, m_idx, t_idx, l_idx = job
+            request = requests[course_idx]
+            module = outlines[course_idx]["modules"][m_idx]
+            topic = module["topics"][t_idx]
+            lesson_title = topic["lessons"][l_idx].get("lessonTitle", "")
+            async with limiter, generation_admission.slot(uid, batch=True):
+                expanded = await expand_lesson_or_fallback(
+                    request.courseTitle,
+                    request.level,
+                    request.durationWeeks,
+                    request.description,
+                    module.get("moduleTitle", ""),
+                    topic.get("topicTitle", ""),
+                    lesson_title,
+                )
+            topic["lessons"][l_idx] = expanded
+            progress["lessonsDone"] += 1
+            pending_modules[(course_idx, m_idx)] -= 1
+            pending_courses[course_idx] -= 1
+            if pending_courses[course_idx] == 0:
+                finish_course(course_idx)
+            elif pending_modules[(course_idx, m_idx)] == 0:
+                # Persistir parcialmente al completar cada módulo
+                draft_refs[course_idx].update({
+                    "modules": outlines[course_idx].get("modules", []),
+                    "updatedAt": datetime.utcnow(),
+                })
+            else:
+                return
+            batch_ref.update({
+                "coursesDone": progress["coursesDone"],
+                "lessonsDone": progress["lessonsDone"],
+                "updatedAt": datetime.utcnow(),
+            })
+
+        async with anyio.create_task_group() as tg:
+            for job in jobs:
+                tg.start_soon(expand_job, job)
+
+        batch_ref.update({
+            "status": "done",
+            "coursesDone": progress["coursesDone"],
+            "coursesFailed": progress["coursesFailed"],
+            "lessonsDone": progress["lessonsDone"],
+            "updatedAt": datetime.utcnow(),
+        })
+    except Exception as e:
+        batch_ref.update({
+            "status": "error",
+            "errorMessage": str(e),
+            "updatedAt": datetime.utcnow(),
+        })
+        print("[run_batch] error:", e)
+        # Los cursos sin terminar no deben quedarse en "queued"/"generating" para siempre:
+        # se marcan como error conservando los módulos parciales ya expandidos
+        for idx, draft_ref in enumerate(draft_refs):
+            if idx in finished:
+                continue
+            updates = {
+                "status": "error",
+                "errorMessage": f"Batch interrumpido: {e}",
+                "updatedAt": datetime.utcnow(),
+            }
+            if outlines[idx] is not None:
+                updates["modules"] = outlines[idx].get("modules", [])
+            try:
+                draft_ref.update(updates)
+            except Exception as update_error:
+                print(f"[run_batch] error marcando curso {idx}:", update_error)
+    finally:
+        generation_admission.release(ticket)
+
+@router.post("/generate-drafts/batch")
+async def generate_drafts_batch(
+    request: CourseDraftBatchRequest,
+    background_tasks: BackgroundTasks,
+    auth_data: dict = Depends(get_current_user),
+):
+    uid = auth_data["uid"]
+    if not request.courses:
+        raise HTTPException(status_code=400, detail="El batch no contiene cursos")
+    if len(request.courses) > BATCH_MAX_COURSES:
+        raise HTTPException(status_code=400, detail=f"Máximo {BATCH_MAX_COURSES} cursos por batch")
+    # Turno de arranque del batch (429 inmediato si la cola está llena)
+    ticket = admit_generation(uid)
+    try:
+        batch_id = str(uuid.uuid4())
+        draft_ids = [str(uuid.uuid4()) for _ in request.courses]
+        now = datetime.utcnow()
+        write = get_db().batch()
+        for draft_id, course in zip(draft_ids, request.courses):
+            write.set(get_db().collection("drafts").document(draft_id), {
+                "courseTitle": course.courseTitle,
+                "level": course.level,
+                "durationWeeks": course.durationWeeks,
+                "description": course.description,
+                "modules": [],
+                "createdBy": uid,
+                "createdAt": now,
+                "updatedAt": now,
+                "status": "queued",
+                "batchId": batch_id,
+            })
+        write.set(get_db().collection("draftBatches").document(batch_id), {
+            "createdBy": uid,
+            "createdAt": now,
+            "updatedAt": now,
+            "status": "queued",
+            "draftIds": draft_ids,
+            "coursesTotal": len(draft_ids),
+            "coursesDone": 0,
+            "coursesFailed": 0,
+            "lessonsTotal": 0,
+            "lessonsDone": 0,
+        })
+        write.commit()
+    except BaseException:
+        generation_admission.release(ticket)
+        raise
+    background_tasks.add_task(
+        run_batch,
+        batch_id,
+        request.courses,
+        draft_ids,
+        uid,
+        ticket,
+    )
+    return {"batchId": batch_id, "draftIds": draft_ids}
+
+def get_owned_batch(batch_id: str, uid: str) -> dict:
+    doc = get_db().collection("draftBatches").document(batch_id).get()
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Batch no encontrado")
+    data = doc.to_dict()
+    if data.get("createdBy") != uid:
+        raise HTTPException(status_code=403, detail="No tienes permiso sobre este batch")
+    data["id"] = batch_id
+    return data
+
+# Progreso agregado del batch (polling)
+@router.get("/generate-drafts/batch/{batch_id}")
+async def batch_progress(
+    batch_id: str = Path(...),
+    auth_data: dict = Depends(get_current_user),
+):
+    return {"batch": get_owned_batch(batch_id, auth_data["uid"])}
+
+# Resultado parcial de un curso concreto del batch
+@router.get("/generate-drafts/batch/{batch_id}/courses/{index}")
+async def batch_course_progress(
+    batch_id: str = Path(...),
+    index: int = Path(..., ge=0),
+    auth_data: dict = Depends(get_current_user),
+):
+    batch = get_owned_batch(batch_id, auth_data["uid"])
+    draft_ids = batch.get("draftIds", [])
+    if index >= len(draft_ids):
+        raise HTTPException(status_code=404, detail="Curso no encontrado en el batch")
+    doc = get_db().collection("drafts").document(draft_ids[index]).get()
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Draft no encontrado")
+    data = doc.to_dict()
+    data["id"] = draft_ids[index]
+    return {"draft": data}
@@ -1,11 +1,12 @@
 from fastapi import APIRouter, HTTPException
-from ..firebase_client import db
+from ..firebase_client import get_db
+from ..lesson_store import fetch_lesson_contents
 
 router = APIRouter(tags=["courses"])
 
 @router.get("/courses/{course_id}")
 def get_course_full(course_id: str):
-    course_ref = db.collection("courses").document(course_id)
+    course_ref = get_db().collection("courses").document(course_id)
     course_doc = course_ref.get()
     if not course_doc.exists:
         raise HTTPException(status_code=404, detail="Curso no encontrado")
@@ -15,6 +16,7 @@ def get_course_full(course_id: str):
 
     modules_snap = course_ref.collection("modules").stream()
     modules = []
+    referenced_lessons = []
     for m in modules_snap:
         mdata = m.to_dict()
         mdata["id"] = m.id
@@ -26,10 +28,18 @@ def get_course_full(course_id: str):
             for l in course_ref.collection("modules").document(m.id).collection("topics").document(t.id).collection("lessons").stream():
                 ldata = l.to_dict()
                 ldata["id"] = l.id
+                if ldata.get("contentRef"):
+                    referenced_lessons.append(ldata)
                 lessons_list.append(ldata)
             tdata["lessons"] = lessons_list
             topics_list.append(tdata)
         mdata["topics"] = topics_list
         modules.append(mdata)
+    # Lecciones publicadas con contenido direccionado por hash: un get_all por bloque
+    contents = fetch_lesson_contents([l["contentRef"] for l in referenced_lessons])
+    for ldata in referenced_lessons:
+        content = contents.get(ldata["contentRef"], {})
+        ldata["theory"] = content.get("theory")
+        ldata["tests"] = content.get("tests", [])
     course["modules"] = modules
     return {"course": course}
@@ -2,31 +2,62 @@
 from fastapi import APIRouter, Depends, HTTPException, Path, BackgroundTasks
 from fastapi.responses import StreamingResponse
 from typing import Any
-from ..models import CourseDraftRequest, CourseDraftUpdateRequest, PublishDraftRequest
-from ..dependencies import get_current_user
-from ..firebase_client import db
-from ..ai_generator import generate_outline, expand_module, generate_outline_temporary
+from ..models import CourseDraftRequest, CourseDraftUpdateRequest, PublishDraftRequest, DraftPatchRequest, Module
+from ..dependencies import get_current_user, admit_generation
+from ..admission import generation_admission, Ticket
+from ..firebase_client import get_db
+from ..draft_patch import apply_operations, modules_to_validate
+from ..lesson_store import lesson_content, content_hash, missing_lesson_contents, write_in_batches
+from ..ai_generator import expand_module
+from ..outline_index import get_or_generate_outline
 from datetime import datetime
 import uuid
 import json
+import os
+import copy
+from pydantic import ValidationError
 from ..utils import slugify
 
 router = APIRouter(tags=["drafts"])
 
+QUEUE_POLL_SECONDS = 2.0
+# Espera máxima en cola para /generate-draft (petición HTTP normal, sin SSE)
+QUEUE_WAIT_TIMEOUT_SECONDS = float(os.getenv("GENERATION_QUEUE_WAIT_SECONDS", "20"))
+
+class AdmissionStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que libera el ticket de admisión al terminar la respuesta,
+    aunque el cuerpo no llegue a iterarse (cliente desconectado antes del primer
+    chunk): el finally de un generador que nunca arrancó no se ejecuta.
+    """
+
+    def __init__(self, content, ticket: Ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            generation_admission.release(self.ticket)
+
+async def wait_for_admission_events(ticket: Ticket):
+    # Emite la posición en cola mientras el ticket espera turno
+    while not ticket.admitted:
+        position = generation_admission.position(ticket)
+        yield f"event: queue\ndata: {json.dumps({'status': 'queued', 'position': position})}\n\n"
+        await generation_admission.wait(ticket, timeout=QUEUE_POLL_SECONDS)
+
 async def expand_and_persist_full_draft(
     draft_id: str,
     request: CourseDraftRequest,
     uid: str,
+    outline: dict,
+    ticket: Ticket | None = None,
 ):
-    draft_ref = db.collection("drafts").document(draft_id)
+    draft_ref = get_db().collection("drafts").document(draft_id)
     try:
-        # 1. Obtener outline básico
-        outline = await generate_outline(
-            course_title=request.courseTitle,
-            level=request.level,
-            duration_weeks=request.durationWeeks,
-            description=request.description,
-        )
+        # 1. Partir del mismo outline que el endpoint devolvió al cliente
         expanded_modules = []
         for module in outline.get("modules", []):
             expanded = await expand_module(
@@ -56,6 +87,9 @@ async def expand_and_persist_full_draft(
             "updatedAt": datetime.utcnow(),
         })
         print("[expand_and_persist_full_draft] error:", e)
+    finally:
+        if ticket is not None:
+            generation_admission.release(ticket)
 
 @router.post("/generate-draft")
 async def generate_draft(
@@ -64,34 +98,49 @@ async def generate_draft(
     auth_data: dict = Depends(get_current_user),
 ):
     uid = auth_data["uid"]
+    ticket = admit_generation(uid)
     draft_id = str(uuid.uuid4())
-    draft_ref = db.collection("drafts").document(draft_id)
-    # Generar outline inicial
-    outline = await generate_outline(
-        course_title=request.courseTitle,
-        level=request.level,
-        duration_weeks=request.durationWeeks,
-        description=request.description,
-    )
-    initial_modules = outline.get("modules", [])
-    # Crear draft inicial en estado "generating"
-    draft_ref.set({
-        "courseTitle": request.courseTitle,
-        "level": request.level,
-        "durationWeeks": request.durationWeeks,
-        "description": request.description,
-        "modules": initial_modules,
-        "createdBy": uid,
-        "createdAt": datetime.utcnow(),
-        "updatedAt": datetime.utcnow(),
-        "status": "generating",
-    })
-    # Lanzar expansión en background
+    draft_ref = get_db().collection("drafts").document(draft_id)
+    try:
+        if not await generation_admission.wait(ticket, timeout=QUEUE_WAIT_TIMEOUT_SECONDS):
+            position = generation_admission.position(ticket)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Generación en cola (posición {position}); inténtalo más tarde",
+                headers={"Retry-After": str(generation_admission.retry_after())},
+            )
+        # Generar outline inicial (o reutilizar uno casi idéntico)
+        outline, reused = await get_or_generate_outline(
+            course_title=request.courseTitle,
+            level=request.level,
+            duration_weeks=request.durationWeeks,
+            description=request.description,
+            force_fresh=request.forceFresh,
+        )
+        initial_modules = outline.get("modules", [])
+        # Crear draft inicial en estado "generating"
+        draft_ref.set({
+            "courseTitle": request.courseTitle,
+            "level": request.level,
+            "durationWeeks": request.durationWeeks,
+            "description": request.description,
+            "modules": initial_modules,
+            "createdBy": uid,
+            "createdAt": datetime.utcnow(),
+            "updatedAt": datetime.utcnow(),
+            "status": "generating",
+        })
+    except BaseException:
+        generation_admission.release(ticket)
+        raise
+    # Lanzar expansión en background (libera el ticket al terminar)
     background_tasks.add_task(
         expand_and_persist_full_draft,
         draft_id,
         request,
         uid,
+        copy.deepcopy(outline),
+        ticket,
     )
     return {
         "draftId": draft_id,
@@ -114,16 +163,20 @@ async def generate_draft_stream(
     auth_data: dict = Depends(get_current_user),
 ):
     uid = auth_data["uid"]
+    ticket = admit_generation(uid)
     async def event_generator():
         draft_id = str(uuid.uuid4())
-        draft_ref = db.collection("drafts").document(draft_id)
+        draft_ref = get_db().collection("drafts").document(draft_id)
         try:
-            # 1. Obtener outline básico
-            outline = await generate_outline(
+            async for queue_event in wait_for_admission_events(ticket):
+                yield queue_event
+            # 1. Obtener outline básico (o reutilizar uno casi idéntico)
+            outline, reused = await get_or_generate_outline(
                 course_title=request.courseTitle,
                 level=request.level,
                 duration_weeks=request.durationWeeks,
                 description=request.description,
+                force_fresh=request.forceFresh,
             )
             # Inicializar draft parcial en Firestore
             initial_modules = outline.get("modules", [])
@@ -139,7 +192,7 @@ async def generate_draft_stream(
                 "status": "generating",
             })
             # Emitir outline inicial
-            yield f"event: outline\ndata: {json.dumps({'outline': outline})}\n\n"
+            yield f"event: outline\ndata: {json.dumps({'outline': outline, 'reused': reused})}\n\n"
             expanded_modules = []
             for idx, module in enumerate(outline.get("modules", [])):
                 expanded_module = await expand_module(
@@ -181,7 +234,9 @@ async def generate_draft_stream(
             error_payload = {"error": str(e)}
             # No se actualiza el status para preservar parcial
             yield f"event: error\ndata: {json.dumps(error_payload)}\n\n"
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+        finally:
+            generation_admission.release(ticket)
+    return AdmissionStreamingResponse(event_generator(), ticket, media_type="text/event-stream")
 
 # Nuevo endpoint para generación temporal sin persistir en DB
 @router.post("/generate-draft-stream-temp")
@@ -191,19 +246,25 @@ async def generate_draft_stream_temp(
 ):
     """
     Genera curso en streaming temporal sin persistir en base de datos
+    (solo lee el índice de outlines; no lo amplía)
     """
+    ticket = admit_generation(auth_data["uid"])
     async def event_generator():
         try:
-            # 1. Generar outline inicial (temporal)
-            outline = await generate_outline_temporary(
+            async for queue_event in wait_for_admission_events(ticket):
+                yield queue_event
+            # 1. Generar outline inicial (temporal, o reutilizar uno casi idéntico)
+            outline, reused = await get_or_generate_outline(
                 course_title=request.courseTitle,
                 level=request.level,
                 duration_weeks=request.durationWeeks,
                 description=request.description,
+                force_fresh=request.forceFresh,
+                persist=False,
             )
             
             # Emitir outline inicial
-            yield f"event: outline\ndata: {json.dumps({'outline': outline})}\n\n"
+            yield f"event: outline\ndata: {json.dumps({'outline': outline, 'reused': reused})}\n\n"
             
             expanded_modules = []
             for idx, module in enumerate(outline.get("modules", [])):
@@ -232,8 +293,10 @@ async def generate_draft_stream_temp(
         except Exception as e:
             error_payload = {"error": str(e)}
             yield f"event: error\ndata: {json.dumps(error_payload)}\n\n"
+        finally:
+            generation_admission.release(ticket)
     
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return AdmissionStreamingResponse(event_generator(), ticket, media_type="text/event-stream")
 
 # Nuevo: endpoint para consultar progreso (polling)
 @router.get("/drafts/{draft_id}/progress")
@@ -241,14 +304,28 @@ async def draft_progress(
     draft_id: str = Path(...),
     auth_data: dict = Depends(get_current_user),
 ):
-    draft_ref = db.collection("drafts").document(draft_id)
+    draft_ref = get_db().collection("drafts").document(draft_id)
     doc = draft_ref.get()
     if not doc.exists:
         raise HTTPException(status_code=404, detail="Draft no encontrado")
     data = doc.to_dict()
     data["id"] = draft_id
+    data["updateTime"] = doc.update_time.rfc3339()
     return {"draft": data}
 
+def check_if_update_time(if_update_time: str | None, doc) -> None:
+    # Precondición del cliente: 409 si el draft cambió desde su última lectura
+    if if_update_time is None:
+        return
+    from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+    try:
+        expected = DatetimeWithNanoseconds.from_rfc3339(if_update_time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ifUpdateTime inválido")
+    if expected != doc.update_time:
+        raise HTTPException(status_code=409, detail="El draft fue modificado por otra petición")
+
 # Actualización de draft parcial
 @router.patch("/drafts/{draft_id}")
 async def update_draft(
@@ -257,7 +334,7 @@ async def update_draft(
     auth_data: dict = Depends(get_current_user),
 ):
     uid = auth_data["uid"]
-    draft_ref = db.collection("drafts").document(draft_id)
+    draft_ref = get_db().collection("drafts").document(draft_id)
     doc = draft_ref.get()
     if not doc.exists:
         raise HTTPException(status_code=404, detail="Draft no encontrado")
@@ -266,6 +343,7 @@ async def update_draft(
         raise HTTPException(status_code=403, detail="No tienes permiso sobre este draft")
     if data.get("status") != "draft":
         raise HTTPException(status_code=400, detail="Solo se pueden editar drafts no publicados")
+    check_if_update_time(update.ifUpdateTime, doc)
     updates: dict[str, Any] = {}
     if update.courseTitle is not None:
         updates["courseTitle"] = update.courseTitle
@@ -280,11 +358,85 @@ async def update_draft(
     if not updates:
         raise HTTPException(status_code=400, detail="Nada que actualizar")
     updates["updatedAt"] = datetime.utcnow()
-    draft_ref.update(updates)
-    updated = draft_ref.get().to_dict()
+    from google.api_core.exceptions import FailedPrecondition
+    # Precondición sobre la versión leída: cubre también la carrera entre lectura y escritura
+    try:
+        result = draft_ref.update(updates, option=get_db().write_option(last_update_time=doc.update_time))
+    except FailedPrecondition:
+        raise HTTPException(status_code=409, detail="El draft fue modificado por otra petición")
+    # Construir la respuesta sin volver a leer el documento
+    updated = {**data, **updates}
     updated["id"] = draft_id
+    updated["updateTime"] = result.update_time.rfc3339()
     return {"draft": updated}
 
+# Edición granular (operaciones estilo JSON Patch) con concurrencia optimista
+@router.patch("/drafts/{draft_id}/operations")
+async def patch_draft_operations(
+    patch: DraftPatchRequest,
+    draft_id: str = Path(...),
+    auth_data: dict = Depends(get_current_user),
+):
+    # Importe diferido: google.api_core carga protobuf/grpc y penaliza el arranque
+    from google.api_core.exceptions import FailedPrecondition
+
+    uid = auth_data["uid"]
+    if not patch.operations:
+        raise HTTPException(status_code=400, detail="Nada que actualizar")
+    draft_ref = get_db().collection("drafts").document(draft_id)
+    doc = draft_ref.get()
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Draft no encontrado")
+    data = doc.to_dict()
+    if data.get("createdBy") != uid:
+        raise HTTPException(status_code=403, detail="No tienes permiso sobre este draft")
+    if data.get("status") != "draft":
+        raise HTTPException(status_code=400, detail="Solo se pueden editar drafts no publicados")
+    check_if_update_time(patch.ifUpdateTime, doc)
+
+    operations = [o.dict() for o in patch.operations]
+    try:
+        updated, changes, touched, affected_modules = apply_operations(data, operations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "modules" in touched and not isinstance(updated.get("modules"), list):
+        raise HTTPException(status_code=422, detail="modules debe ser una lista")
+    scalar_fields = touched - {"modules"}
+    null_fields = sorted(f for f in scalar_fields if updated.get(f) is None)
+    if null_fields:
+        raise HTTPException(status_code=422, detail=f"{', '.join(null_fields)} no puede ser null")
+    try:
+        validated_modules = {}
+        for module in modules_to_validate(updated, affected_modules):
+            if not isinstance(module, dict):
+                raise HTTPException(status_code=422, detail="Cada módulo debe ser un objeto")
+            validated_modules[id(module)] = Module(**module).dict()
+        fields = CourseDraftUpdateRequest(**{f: updated[f] for f in scalar_fields})
+    except (ValidationError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # Se guardan los valores ya convertidos por el modelo ("5" -> 5), no los crudos
+    for field in scalar_fields:
+        updated[field] = getattr(fields, field)
+    for change in changes:
+        if change["path"][1:] in scalar_fields:
+            change["value"] = updated[change["path"][1:]]
+    if validated_modules:
+        updated["modules"] = [validated_modules.get(id(m), m) for m in updated["modules"]]
+
+    # Firestore no permite actualizar un elemento de un array: se reescribe el campo tocado
+    updates: dict[str, Any] = {field: updated[field] for field in touched}
+    updates["updatedAt"] = datetime.utcnow()
+    try:
+        result = draft_ref.update(updates, option=get_db().write_option(last_update_time=doc.update_time))
+    except FailedPrecondition:
+        raise HTTPException(status_code=409, detail="El draft fue modificado por otra petición")
+    # Devolver solo el delta aplicado y la nueva versión
+    return {
+        "draftId": draft_id,
+        "updateTime": result.update_time.rfc3339(),
+        "changes": changes,
+    }
+
 @router.post("/publish-draft/{draft_id}")
 async def publish_draft(
     draft_id: str = Path(...), # ID del draft desde la ruta
@@ -292,7 +444,7 @@ async def publish_draft(
     auth_data: dict = Depends(get_current_user), # <-- Corrección: Usar ':' aquí también
 ):
     uid = auth_data["uid"]
-    draft_ref = db.collection("drafts").document(draft_id)
+    draft_ref = get_db().collection("drafts").document(draft_id)
     draft_doc = draft_ref.get()
     if not draft_doc.exists:
         raise HTTPException(status_code=404, detail="Draft no encontrado")
@@ -303,9 +455,9 @@ async def publish_draft(
         raise HTTPException(status_code=400, detail="Este draft ya fue publicado")
 
     course_id = str(uuid.uuid4())
-    course_ref = db.collection("courses").document(course_id)
+    course_ref = get_db().collection("courses").document(course_id)
     # Usar request_data.thumbnail
-    course_ref.set({
+    course_data = {
         "courseTitle": draft.get("courseTitle"),
         "level": draft.get("level"),
         "durationWeeks": draft.get("durationWeeks"),
@@ -317,39 +469,44 @@ async def publish_draft(
         "thumbnail": request_data.thumbnail if request_data else "", # <-- Acceder correctamente
         "createdBy": uid,
         "createdAt": datetime.utcnow(),
-    })
+    }
+    structure_writes = [(course_ref, course_data)]
+    # Contenido de lecciones por hash: solo se escribe el que no exista ya
+    contents: dict[str, dict] = {}
     modules = draft.get("modules", [])
     for module in modules:
         module_id = str(module.get("moduleNumber", uuid.uuid4()))
         module_ref = course_ref.collection("modules").document(module_id)
-        module_ref.set({
+        structure_writes.append((module_ref, {
             "moduleNumber": module.get("moduleNumber"),
             "moduleTitle": module.get("moduleTitle"),
             "weeks": module.get("weeks", []),
-        })
+        }))
         for topic in module.get("topics", []):
             raw_topic_title = topic.get("topicTitle", "")
             topic_id = slugify(raw_topic_title)
             topic_ref = module_ref.collection("topics").document(topic_id)
-            topic_ref.set({
+            structure_writes.append((topic_ref, {
                 "topicTitle": raw_topic_title,
-            })
+            }))
             for lesson in topic.get("lessons", []):
                 raw_lesson_title = lesson.get("lessonTitle", "")
                 lesson_id = slugify(raw_lesson_title)
                 lesson_ref = topic_ref.collection("lessons").document(lesson_id)
-                lesson_ref.set({
+                content = lesson_content(lesson)
+                content_ref = content_hash(content)
+                contents[content_ref] = content
+                structure_writes.append((lesson_ref, {
                     "lessonTitle": raw_lesson_title,
-                    "theory": lesson.get("theory"),
-                    "tests": lesson.get("tests", []),
-                })
+                    "contentRef": content_ref,
+                }))
+    # El contenido va antes que la estructura que lo referencia
+    write_in_batches(missing_lesson_contents(contents) + structure_writes)
     draft_ref.update({
         "status": "published",
         "publishedAt": datetime.utcnow(),
         "courseId": course_id,
     })
 
-    created_course_doc = course_ref.get()
-    course_data = created_course_doc.to_dict()
     course_data["id"] = course_id
     return {"course": course_data}
\ No newline at end of file
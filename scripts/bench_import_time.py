@@ -0,0 +1,62 @@
+"""
+Benchmark del tiempo de importación de app.main (arranque en frío).
+
+Uso: python scripts/bench_import_time.py [--runs 5] [--max-seconds 1.5]
+
+Falla (exit 1) si la mediana supera el presupuesto o si se cargan al importar
+SDKs que deben inicializarse de forma perezosa.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos pesados que solo deben cargarse en la primera petición o en el warm-up
+LAZY_MODULES = ["firebase_admin", "google.cloud.firestore", "google.api_core", "openai"]
+
+PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+def run_once() -> dict:
+    # Proceso nuevo en cada ejecución para medir sin caché de sys.modules
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET", "1.5")))
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    times = [r["seconds"] for r in results]
+    median = statistics.median(times)
+    print(f"import app.main: mediana {median:.3f}s, min {min(times):.3f}s, max {max(times):.3f}s ({args.runs} runs)")
+
+    failed = False
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    if loaded:
+        print(f"ERROR: módulos cargados al importar (deberían ser perezosos): {', '.join(loaded)}")
+        failed = True
+    if median > args.max_seconds:
+        print(f"ERROR: la mediana supera el presupuesto de {args.max_seconds:.3f}s")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())